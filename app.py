@@ -1,59 +1,194 @@
 #!/usr/bin/env python3
 
+import asyncio
+import concurrent.futures
 import io
-import json
-from urllib.parse import urlencode
+import re
+import threading
+from functools import lru_cache
+from urllib.parse import quote, urlsplit, urlunsplit
+import aiohttp
 import pandas as pd
-import requests
 import streamlit as st
 
 
 CDX_BASE = "https://nettarkivet.nb.no/search/cdx"
 REPLAY_BASE = "https://nettarkivet.nb.no/search/"
 
+# Max number of CDX requests in flight at once, to stay fair to the server.
+CONCURRENCY = 32
 
-def build_cdx_url(original_url: str) -> str:
+# Timestamps in the CDX JSON records are 14-digit strings ("yyyyMMddhhmmss"),
+# so they can be pulled straight out of the raw bytes without parsing JSON,
+# and min() on them is chronological.
+_TS_RE = re.compile(rb'"timestamp"\s*:\s*"(\d{14})"')
+
+
+def canonicalize(url: str) -> str:
+    """
+    Takes a URL and returns a canonical form (lowercased scheme and host,
+    '/' for an empty path, fragment dropped), so trivial variants of the
+    same address are looked up only once.
+    """
+    parts = urlsplit(url)
+    return urlunsplit(
+        (
+            parts.scheme.lower(),
+            parts.netloc.lower().rstrip("."),
+            parts.path or "/",
+            parts.query,
+            "",
+        )
+    )
+
+
+@lru_cache(maxsize=100_000)
+def build_cdx_url(original_url: str, limit: int | None = None) -> str:
     """
     Takes a URL as input and
     returns a CDX query URL that will request a JSON response from nettarkivet's CDX Server API.
+    An optional limit caps the number of records the server returns.
+    Pure string formatting, so results are memoized across calls and reruns.
     """
-    params = {"url": original_url, "output": "json"}
-    return f"{CDX_BASE}?{urlencode(params)}"
+    # fl=timestamp: the timestamp is the only field we read, and asking for
+    # just that shrinks each record from a full CDX line to ~30 bytes.
+    cdx_url = f"{CDX_BASE}?url={quote(original_url, safe='')}&output=json&fl=timestamp"
+    if limit is not None:
+        cdx_url += f"&limit={limit}"
+    return cdx_url
 
 
-def query_cdx(original_url: str) -> tuple[int, str | None]:
+async def _get_body(session: aiohttp.ClientSession, cdx_url: str) -> bytes:
+    """Sends one GET to the CDX Server API and returns the raw response bytes."""
+    async with session.get(
+        cdx_url,
+        timeout=aiohttp.ClientTimeout(total=30),
+    ) as resp:
+        resp.raise_for_status()
+        return await resp.read()
+
+
+async def _earliest_ts(session: aiohttp.ClientSession, original_url: str) -> str | None:
     """
-    Takes a CDX query URL, sends a request to nettarkivets CDX Server API, then
-    extracts information from the JSON response and
-    returns the number of indexed versions and the value of the earliest timestamp (if any).
+    Fetches just the earliest capture with limit=1 (the index is already in
+    ascending timestamp order) and returns its timestamp, or None if the URL
+    is not indexed (the server sends an empty body then).
     """
-    cdx_url = build_cdx_url(original_url)
-    resp = requests.get(cdx_url, timeout=30)
-    resp.raise_for_status()
+    body = await _get_body(session, build_cdx_url(original_url, limit=1))
+    match = _TS_RE.search(body)
+    return match.group(1).decode() if match else None
 
-    timestamps: list[str] = []
 
-    for line in resp.text.splitlines():
-        line = line.strip()
-        if not line:
-            continue
+async def _count(session: aiohttp.ClientSession, original_url: str) -> int:
+    """Fetches the timestamp-only record list and returns the number of captures."""
+    body = await _get_body(session, build_cdx_url(original_url))
+    return len(_TS_RE.findall(body))
 
-        try:
-            rec = json.loads(line)
-        except json.JSONDecodeError:
-            continue
 
-        if isinstance(rec, dict):
-            ts = rec.get("timestamp")
-            if ts:
-                timestamps.append(str(ts))
+async def fetch_one(
+    session: aiohttp.ClientSession,
+    semaphore: asyncio.Semaphore,
+    original_url: str,
+) -> tuple[str, int, str | None]:
+    """
+    Looks one URL up in nettarkivets CDX Server API and
+    returns the URL together with the number of indexed versions and the earliest timestamp.
+    The earliest-capture and count queries run concurrently so their latency overlaps.
+    Failed lookups are reported as not indexed, so one bad URL does not stop the batch.
+    """
+    try:
+        async with semaphore:
+            earliest_ts, count = await asyncio.gather(
+                _earliest_ts(session, original_url),
+                _count(session, original_url),
+            )
+    except Exception:
+        return original_url, 0, None
+
+    return original_url, count, earliest_ts
 
-    if not timestamps:
-        return 0, None
 
-    return len(timestamps), min(timestamps)
+async def run_all(
+    session: aiohttp.ClientSession,
+    urls: list[str],
+    progress_callback,
+) -> dict[str, tuple[int, str | None]]:
+    """
+    Dispatches CDX lookups for all URLs concurrently (bounded by CONCURRENCY) and
+    returns a mapping from URL to (number of versions, earliest timestamp).
+    Calls progress_callback(done_count) as each lookup completes.
+    """
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    results: dict[str, tuple[int, str | None]] = {}
+
+    tasks = [fetch_one(session, semaphore, url) for url in urls]
+
+    for done, coro in enumerate(asyncio.as_completed(tasks), start=1):
+        url, count, earliest_ts = await coro
+        results[url] = (count, earliest_ts)
+        progress_callback(done)
 
+    return results
+
+
+async def _make_session() -> aiohttp.ClientSession:
+    """Creates the shared aiohttp session; must run on the loop that will use it."""
+    connector = aiohttp.TCPConnector(
+        limit=CONCURRENCY,
+        limit_per_host=CONCURRENCY,
+        keepalive_timeout=30,
+    )
+    # br first: CDX record lists compress ~10x, and brotli beats gzip on them
+    return aiohttp.ClientSession(
+        connector=connector,
+        headers={"Accept-Encoding": "br, gzip, deflate"},
+    )
 
+
+def _http() -> tuple[asyncio.AbstractEventLoop, aiohttp.ClientSession]:
+    """
+    Returns the event loop and aiohttp session for this browser session,
+    creating them on first use. The loop runs in a daemon thread and both are
+    kept in st.session_state, so later button clicks reuse warm TCP+TLS
+    connections and DNS caches instead of rebuilding everything per batch.
+    """
+    if "http" not in st.session_state:
+        loop = asyncio.new_event_loop()
+        threading.Thread(target=loop.run_forever, daemon=True).start()
+        session = asyncio.run_coroutine_threadsafe(_make_session(), loop).result()
+        st.session_state.http = (loop, session)
+
+    return st.session_state.http
+
+
+@st.cache_data(ttl=3600, max_entries=10000, show_spinner=False)
+def lookup_batch(urls: tuple[str, ...], _progress_callback) -> dict[str, tuple[int, str | None]]:
+    """
+    Runs the async fan-out for a batch of unique URLs and caches the result,
+    so re-running the same list (e.g. after a rerun of the script) skips the network entirely.
+    The leading underscore keeps the progress callback out of the cache key;
+    it is only ever called from this (script) thread, since Streamlit
+    elements cannot be touched from the loop thread.
+    """
+    loop, session = _http()
+
+    done = [0]
+    future = asyncio.run_coroutine_threadsafe(
+        run_all(session, list(urls), lambda n: done.__setitem__(0, n)),
+        loop,
+    )
+
+    last_reported = -1
+    while True:
+        try:
+            return future.result(timeout=0.1)
+        except concurrent.futures.TimeoutError:
+            if done[0] != last_reported:
+                last_reported = done[0]
+                _progress_callback(done[0])
+
+
+@lru_cache(maxsize=100_000)
 def build_replay_url(original_url: str, timestamp: str | None) -> str | None:
     """
     Takes a URL and timestamp, combines them with the replay base URL, then
@@ -64,6 +199,35 @@ def build_replay_url(original_url: str, timestamp: str | None) -> str | None:
     return f"{REPLAY_BASE}{timestamp}/{original_url}"
 
 
+@st.cache_data(show_spinner=False)
+def build_xlsx(records: tuple[tuple, ...]) -> bytes:
+    """
+    Takes the result rows as an immutable tuple of tuples, builds the Excel
+    workbook once and returns its bytes. Cached so Streamlit reruns (e.g. the
+    click on the download button itself) reuse the serialized workbook
+    instead of rebuilding it.
+    constant_memory makes xlsxwriter serialize rows as they are written
+    instead of holding the whole sheet in memory, and strings_to_urls skips
+    its slow URL detection on the Replay column.
+    """
+    df = pd.DataFrame(records, columns=["URL", "Indexed", "Versions", "Replay"])
+
+    output = io.BytesIO()
+    with pd.ExcelWriter(
+        output,
+        engine="xlsxwriter",
+        engine_kwargs={
+            "options": {
+                "constant_memory": True,
+                "strings_to_urls": False,
+            }
+        },
+    ) as writer:
+        df.to_excel(writer, index=False, sheet_name="CDX counts")
+
+    return output.getvalue()
+
+
 def main():
     # Streamlit UI
     st.set_page_config(
@@ -105,19 +269,14 @@ def main():
     # Collect URLs from file and text input
     urls: list[str] = []
 
-    # From uploaded file
+    # From uploaded file: decode the buffer once and split, rather than
+    # decoding and stripping line objects one at a time
     if uploaded_file is not None:
-        for raw_line in uploaded_file:
-            line = raw_line.decode("utf-8", errors="ignore").strip()
-            if line:
-                urls.append(line)
+        raw = uploaded_file.getvalue().decode("utf-8", errors="ignore")
+        urls.extend(filter(None, (line.strip() for line in raw.splitlines())))
 
     # From text input
-    if pasted_urls_text.strip():
-        for line in pasted_urls_text.splitlines():
-            url = line.strip()
-            if url:
-                urls.append(url)
+    urls.extend(filter(None, (line.strip() for line in pasted_urls_text.splitlines())))
 
     if not urls:
         st.warning("Ingen URLer funnet. Last opp en fil eller lim inn URLer.")
@@ -128,38 +287,47 @@ def main():
     st.info(f"Fant {len(urls)} URLer. Slår opp i indeksen ...")
 
     progress_bar = st.progress(0, text="Starter ...")
-    results = []
 
-    total = len(urls)
+    # Duplicates and trivial variants of the same URL are looked up only once
+    unique_urls = list(dict.fromkeys(canonicalize(url) for url in urls))
+    total = len(unique_urls)
 
-    for i, url in enumerate(urls, start=1):
-        try:
-            count, earliest_ts = query_cdx(url)
-        except Exception:
-            count, earliest_ts = 0, None
-
-        replay_url = build_replay_url(url, earliest_ts)
-        indexed = "JA" if count > 0 else "NEI"
-
-        results.append(
-            {
-                "URL": url,
-                "Indexed": indexed,
-                "Versions": count,
-                "Replay": replay_url,
-            }
-        )
-
-        progress = i / total
+    # lookup_batch polls for progress at 10 Hz and only reports changes, so
+    # the bar is redrawn at most a few times per second however large the
+    # batch is.
+    def update_progress(done: int) -> None:
         progress_bar.progress(
-            progress,
-            text=f"{i} / {total} URLer slått opp",
+            done / total,
+            text=f"{done} / {total} URLer slått opp",
         )
 
+    results_by_url = lookup_batch(tuple(unique_urls), update_progress)
+    progress_bar.progress(1.0, text=f"{total} / {total} URLer slått opp")
+
+    # One list per column (instead of one dict per row), assigned by index
+    n_rows = len(urls)
+    indexed: list[str | None] = [None] * n_rows
+    versions: list[int] = [0] * n_rows
+    replays: list[str | None] = [None] * n_rows
+
+    for i, url in enumerate(urls):
+        count, earliest_ts = results_by_url[canonicalize(url)]
+
+        indexed[i] = "JA" if count > 0 else "NEI"
+        versions[i] = count
+        replays[i] = build_replay_url(url, earliest_ts)
+
     st.success(f"Ferdig! Slått opp {total} URLer.")
 
     # Generate DataFrame and show table
-    df = pd.DataFrame(results, columns=["URL", "Indexed", "Versions", "Replay"])
+    df = pd.DataFrame(
+        {
+            "URL": urls,
+            "Indexed": indexed,
+            "Versions": versions,
+            "Replay": replays,
+        }
+    )
 
     if len(df) > max_rows_to_display:
         st.info(
@@ -183,15 +351,11 @@ def main():
     )
 
     # Excel download
-    output = io.BytesIO()
-    with pd.ExcelWriter(output, engine="xlsxwriter") as writer:
-        df.to_excel(writer, index=False, sheet_name="CDX counts")
-
-    output.seek(0)
+    xlsx_bytes = build_xlsx(tuple(map(tuple, df.itertuples(index=False))))
 
     st.download_button(
         label="Last ned som Excel",
-        data=output,
+        data=xlsx_bytes,
         file_name="indekserte_urler.xlsx",
         mime=(
             "application/vnd.openxmlformats-officedocument."